@@ -22,7 +22,7 @@ Technical Architecture:
     - Uses a map representation (can be a set of coordinates, a shapefile, etc.).
 3. Data Storage:
     - Stores user data, attendance logs, and potentially map data.
-    - (Using in-memory storage for this example, should be replaced with a database)
+    - Attendance records are stored in SQLite; user data is kept in memory.
 4. Security:
     - Uses a Telegram bot token for authentication.
     - (Consider secure storage of the token and user data in a production environment)
@@ -57,10 +57,19 @@ Important Considerations:
     Additional measures (e.g., requiring a photo, manual verification) may be needed for high-security scenarios.
 """
 
+import asyncio
+import functools
 import logging
-import datetime
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+import math
+import os
+import sqlite3
+import time
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -69,9 +78,12 @@ from telegram.ext import (
     ConversationHandler,
     filters,
 )
-from typing import Dict, Tuple, List
+from typing import TYPE_CHECKING, DefaultDict, Dict, List, Tuple, Optional
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import numpy as np
+
 load_dotenv()
 
 # Enable logging
@@ -89,28 +101,74 @@ GET_LOCATION = 2
 # Maximum number of allowed attempts
 MAX_ATTEMPTS = 3
 
-# In-memory storage for user data and attendance records (replace with a database)
+# In-memory storage for user data (replace with a database)
 user_data: Dict[int, Dict] = {}  # {user_id: {username: str, ...}}
-attendance_records: List[Dict] = []  # List of attendance records
-attempt_counts: Dict[int, int] = {}  # Track attempts per user
+attempt_counts: DefaultDict[int, int] = defaultdict(int)  # Track attempts per user
+
+
+@dataclass(slots=True, frozen=True)
+class AttendanceRecord:
+    """A single attendance check-in, as stored in the attendance table."""
+
+    user_id: int
+    username: str
+    timestamp: int  # nanoseconds since the epoch
+    latitude: float
+    longitude: float
+
+
+# SQLite storage for attendance records (opened in main())
+ATTENDANCE_DB_PATH = "attendance.db"
+db_conn: Optional[sqlite3.Connection] = None
+
+# (record, future) pairs waiting to be written, drained in batches by _flusher()
+ATTENDANCE_BATCH_SIZE = 100
+_attendance_q: Optional[asyncio.Queue] = None
+_flusher_task: Optional[asyncio.Task] = None
+
+# Reply keyboards shared by all handlers (never mutated)
+SHARE_LOCATION_KB = ReplyKeyboardMarkup(
+    [[KeyboardButton(text="Share your location", request_location=True)]],
+    one_time_keyboard=True,
+)
+REMOVE_KB = ReplyKeyboardRemove()
+
+# Center point of the allowed attendance area
+CENTER_LATITUDE = 19.523731621451685
+CENTER_LONGITUDE = -99.2536655776822
+_COS_CENTER_LAT = math.cos(math.radians(CENTER_LATITUDE))
+
+# Kilometers per degree of longitude/latitude around the center point
+# (cheap-ruler approximation, computed once at import time)
+KX = _COS_CENTER_LAT * 111.320
+KY = 110.574
 
-# Telegram Bot Token (replace with your actual token)
-#  Use a secure method to store your token (e.g., environment variable)
-TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Half-size in degrees of the box enclosing the 5 km radius, used to reject
+# far-away points before computing the distance
+_MAX_DLAT = 5.0 / KY
+_MAX_DLON = 5.0 / KX
+
+
+@functools.lru_cache(maxsize=1)
+def _get_token() -> str:
+    """
+    Returns the Telegram bot token from the TELEGRAM_BOT_TOKEN environment
+    variable, read once and cached.
+
+    Raises:
+        RuntimeError: If TELEGRAM_BOT_TOKEN is not set.
+    """
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
+    return token
 
 
-# Dummy function to simulate location validation
 def is_location_valid(latitude: float, longitude: float) -> bool:
     """
     Validates if the given location is within the allowed attendance area.
 
-    This is a placeholder function.  You need to implement the actual logic
-    based on how you represent your map and allowed area.
-
-    For example, you might check if the latitude and longitude fall within
-    a defined bounding box, or if they are within a certain radius of a
-    specified point.  You could also use a more complex geometric
-    calculation if your allowed area is a polygon or other shape.
+    The allowed area is a 5 km radius around CENTER_LATITUDE/CENTER_LONGITUDE.
 
     Args:
         latitude (float): The latitude of the user's location.
@@ -119,61 +177,169 @@ def is_location_valid(latitude: float, longitude: float) -> bool:
     Returns:
         bool: True if the location is valid, False otherwise.
     """
-    # Calculate if location is within 5km radius of the center point
-    # Using the Haversine formula to calculate distance between two points
-    import math
-    
-    # Center point coordinates
-    center_latitude = 19.523731621451685
-    center_longitude = -99.2536655776822
-    
-    # Convert latitude and longitude from degrees to radians
-    lat1_rad = math.radians(latitude)
-    lon1_rad = math.radians(longitude)
-    lat2_rad = math.radians(center_latitude)
-    lon2_rad = math.radians(center_longitude)
-    
-    # Earth radius in kilometers
-    earth_radius = 6371.0
-    
-    # Haversine formula
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    distance = earth_radius * c
-    print(distance)
-    
-    # Check if within 5km radius
-    max_distance = 5.0  # 5 kilometers
-    
-    print(f"Distance from center: {distance:.2f} km")
-    return distance <= max_distance
+    # Calculate if location is within 5km radius of the center point.
+    # At this scale a local flat-earth (equirectangular) projection is accurate
+    # to well under 0.1%, so we compare squared distances and avoid trig.
+    dlat = latitude - CENTER_LATITUDE
+    dlon = longitude - CENTER_LONGITUDE
+    if abs(dlat) > _MAX_DLAT or abs(dlon) > _MAX_DLON:
+        return False
+
+    dx = dlon * KX
+    dy = dlat * KY
+    distance_sq = dx * dx + dy * dy
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Distance from center: %.2f km", math.sqrt(distance_sq))
+    return distance_sq <= 25.0  # (5 kilometers) ** 2
+
+
+def is_location_valid_batch(
+    latitudes: "np.ndarray", longitudes: "np.ndarray"
+) -> "np.ndarray":
+    """
+    Vectorized version of `is_location_valid` for validating many stored
+    locations at once (e.g. auditing past attendance records).  Uses the same
+    approximation as the single-point check, so both always agree.
+
+    Requires numpy, which is imported here so the bot itself does not need it.
+
+    Args:
+        latitudes (np.ndarray): Latitudes of the locations to check.
+        longitudes (np.ndarray): Longitudes of the locations to check.
+
+    Returns:
+        np.ndarray: Boolean array, True where the location is valid.
+    """
+    import numpy as np
+
+    dx = (np.asarray(longitudes, dtype=np.float64) - CENTER_LONGITUDE) * KX
+    dy = (np.asarray(latitudes, dtype=np.float64) - CENTER_LATITUDE) * KY
+    return dx * dx + dy * dy <= 25.0  # (5 kilometers) ** 2
+
+
+def init_db(path: str) -> sqlite3.Connection:
+    """
+    Opens the attendance database and creates the attendance table if needed.
+
+    Args:
+        path (str): Path to the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The open database connection.
+    """
+    # The connection is only written to by the flusher, but from worker threads
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS attendance ("
+        "user_id INTEGER NOT NULL, "
+        "username TEXT, "
+        "timestamp INTEGER NOT NULL, "  # nanoseconds since the epoch
+        "latitude REAL NOT NULL, "
+        "longitude REAL NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+
+def _write_attendance_batch(records: List[AttendanceRecord]) -> None:
+    """Inserts a batch of attendance records in a single transaction."""
+    with db_conn:
+        db_conn.executemany(
+            "INSERT INTO attendance VALUES (?, ?, ?, ?, ?)",
+            [
+                (r.user_id, r.username, r.timestamp, r.latitude, r.longitude)
+                for r in records
+            ],
+        )
 
 
-def record_attendance(
+async def _flusher() -> None:
+    """
+    Drains the attendance queue, writing up to ATTENDANCE_BATCH_SIZE records per
+    transaction so the event loop is never blocked on a database commit.  Each
+    record's future is resolved once its batch has been committed, or failed
+    with the write error.
+    """
+    while True:
+        items = [await _attendance_q.get()]
+        while len(items) < ATTENDANCE_BATCH_SIZE:
+            try:
+                items.append(_attendance_q.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            await asyncio.to_thread(
+                _write_attendance_batch, [record for record, _ in items]
+            )
+        except Exception as exc:
+            # Keep the flusher alive; a dead task would leave the queue undrained
+            logger.exception("Failed to write %d attendance records", len(items))
+            for _, done in items:
+                if not done.done():
+                    done.set_exception(exc)
+        else:
+            for _, done in items:
+                if not done.done():
+                    done.set_result(None)
+        finally:
+            for _ in items:
+                _attendance_q.task_done()
+
+
+async def record_attendance(
     user_id: int, username: str, latitude: float, longitude: float
 ) -> None:
     """
-    Records the user's attendance with timestamp and location.
+    Records the user's attendance with timestamp and location.  The record is
+    written to the database by the background flusher; this returns once it
+    has been committed.
 
     Args:
         user_id (int): The user's Telegram ID.
         username (str): The user's Telegram username.
         latitude (float): The latitude of the user's location.
         longitude (float): The longitude of the user's location.
+
+    Raises:
+        Exception: Whatever error the flusher hit while writing the batch.
     """
-    timestamp = datetime.datetime.now()
-    attendance_records.append(
-        {
-            "user_id": user_id,
-            "username": username,
-            "timestamp": timestamp,
-            "latitude": latitude,
-            "longitude": longitude,
-        }
+    timestamp = time.time_ns()
+    done = asyncio.get_running_loop().create_future()
+    await _attendance_q.put(
+        (AttendanceRecord(user_id, username, timestamp, latitude, longitude), done)
     )
-    logger.info(f"Attendance recorded for user {user_id} at {timestamp}")
+    await done
+    logger.info("Attendance recorded for user %d at %d", user_id, timestamp)
+
+
+def load_attendance_locations(path: str = ATTENDANCE_DB_PATH) -> Tuple[array, array]:
+    """
+    Loads the locations of all stored attendance records as packed arrays of
+    doubles.  `np.frombuffer(lats)` gives a zero-copy view that can be passed
+    straight to `is_location_valid_batch` for audits.  Only committed records
+    are included; records still waiting in the write queue are not.
+
+    Args:
+        path (str): Path to the SQLite database file.
+
+    Returns:
+        Tuple[array, array]: The latitudes and longitudes, in insertion order.
+    """
+    # Use a separate read-only connection so the read never runs inside the
+    # flusher's open transaction on db_conn
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        latitudes = array("d")
+        longitudes = array("d")
+        for latitude, longitude in conn.execute(
+            "SELECT latitude, longitude FROM attendance ORDER BY rowid"
+        ):
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+    finally:
+        conn.close()
+    return latitudes, longitudes
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -185,9 +351,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     username = user.username
     if user_id not in user_data:
         user_data[user_id] = {"username": username}  # Store username
-        logger.info(f"New user: {user_id}, username: {username}")
+        logger.info("New user: %s, username: %s", user_id, username)
     else:
-        logger.info(f"Returning user: {user_id}, username: {username}")
+        logger.info("Returning user: %s, username: %s", user_id, username)
 
     await update.message.reply_text(
         "Verifica tu asistencia con el bot de Telegram.\n"
@@ -205,19 +371,48 @@ async def checkin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Reset attempt count when starting a new check-in
     attempt_counts[user_id] = 0
     
-    # Create a custom keyboard to request the user's location
-    keyboard = [
-        [KeyboardButton(text="Share your location", request_location=True)],
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
-
     await update.message.reply_text(
         "Por favor comparte tu ubicación *actual* usando el botón de abajo para verificar tu asistencia.",
-        reply_markup=reply_markup,
+        reply_markup=SHARE_LOCATION_KB,
     )
     return GET_LOCATION  # Go to the GET_LOCATION state
 
 
+# Replies sent when a location check fails, keyed by failure kind
+_MESSAGES = {
+    "outside_area": (
+        "❌ Verificación de ubicación fallida!\n\n"
+        "Tu ubicación actual está fuera del área permitida. Por favor asegúrate de estar "
+        "en la ubicación correcta y vuelve a intentarlo.\n\n"
+        "Intentos restantes: {remaining}\n"
+        "Haz clic en el botón de abajo para compartir tu ubicación nuevamente:"
+    ),
+    "outside_area_failed": (
+        "❌ Verificación de asistencia fallida!\n\n"
+        "Has excedido el número máximo de intentos (3). "
+        "Por favor intenta nuevamente o contacta al soporte si crees que esto es un error."
+    ),
+    "invalid_location": (
+        "❌ Invalid location data received!\n\n"
+        "Please use the button below to share your location using Telegram's location sharing feature.\n\n"
+        "Attempts remaining: {remaining}"
+    ),
+    "invalid_location_failed": (
+        "❌ Check-in failed!\n\n"
+        "You have exceeded the maximum number of attempts (3). "
+        "Please try again later or contact support if you believe this is an error."
+    ),
+}
+
+
+async def _prompt_retry(update: Update, remaining: int, msg_key: str) -> None:
+    """Asks the user to share their location again after a failed attempt."""
+    await update.message.reply_text(
+        _MESSAGES[msg_key].format(remaining=remaining),
+        reply_markup=SHARE_LOCATION_KB,
+    )
+
+
 async def get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Handles the user's location.  Validates the location, records attendance,
@@ -226,97 +421,41 @@ async def get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     user = update.message.from_user
     user_id = user.id
     username = user_data[user_id]["username"]  # Retrieve username
-    
-    # Initialize attempt count if not exists
-    if user_id not in attempt_counts:
-        attempt_counts[user_id] = 0
-    
+
     if update.message.location:
         location = update.message.location
         latitude = location.latitude
         longitude = location.longitude
-        logger.info(f"Received location from user {user_id}: {latitude}, {longitude}")
+        logger.info(
+            "Received location from user %s: %s, %s", user_id, latitude, longitude
+        )
 
         if is_location_valid(latitude, longitude):
-            record_attendance(user_id, username, latitude, longitude)
+            await record_attendance(user_id, username, latitude, longitude)
             # Reset attempt count on success
             attempt_counts[user_id] = 0
             await update.message.reply_text(
                 "Tu asistencia ha sido registrada. Gracias!",
-                reply_markup=ReplyKeyboardMarkup(
-                    [],
-                    one_time_keyboard=True,  # remove keyboard
-                ),
+                reply_markup=REMOVE_KB,
             )
             return ConversationHandler.END  # End the conversation
-        else:
-            # Increment attempt count
-            attempt_counts[user_id] += 1
-            remaining_attempts = MAX_ATTEMPTS - attempt_counts[user_id]
-            
-            if remaining_attempts > 0:
-                # Create a custom keyboard to request the user's location again
-                keyboard = [
-                    [KeyboardButton(text="Share your location", request_location=True)],
-                ]
-                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
-                
-                await update.message.reply_text(
-                    f"❌ Verificación de ubicación fallida!\n\n"
-                    f"Tu ubicación actual está fuera del área permitida. Por favor asegúrate de estar "
-                    f"en la ubicación correcta y vuelve a intentarlo.\n\n"
-                    f"Intentos restantes: {remaining_attempts}\n"
-                    f"Haz clic en el botón de abajo para compartir tu ubicación nuevamente:",
-                    reply_markup=reply_markup,
-                )
-                return GET_LOCATION  # Remain in the GET_LOCATION state to ask again.
-            else:
-                # Maximum attempts reached
-                await update.message.reply_text(
-                    "❌ Verificación de asistencia fallida!\n\n"
-                    "Has excedido el número máximo de intentos (3). "
-                    "Por favor intenta nuevamente o contacta al soporte si crees que esto es un error.",
-                    reply_markup=ReplyKeyboardMarkup(
-                        [],
-                        one_time_keyboard=True,  # remove keyboard
-                    ),
-                )
-                # Reset attempt count
-                attempt_counts[user_id] = 0
-                return ConversationHandler.END  # End the conversation
+        retry_key, failed_key = "outside_area", "outside_area_failed"
     else:
-        # Increment attempt count for invalid location data
-        attempt_counts[user_id] += 1
-        remaining_attempts = MAX_ATTEMPTS - attempt_counts[user_id]
-        
-        if remaining_attempts > 0:
-            # Create a custom keyboard to request the user's location
-            keyboard = [
-                [KeyboardButton(text="Share your location", request_location=True)],
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
-            
-            await update.message.reply_text(
-                f"❌ Invalid location data received!\n\n"
-                f"Please use the button below to share your location using Telegram's location sharing feature.\n\n"
-                f"Attempts remaining: {remaining_attempts}",
-                reply_markup=reply_markup,
-            )
-            return GET_LOCATION  # Remain in the GET_LOCATION state
-        else:
-            # Maximum attempts reached
-            await update.message.reply_text(
-                "❌ Check-in failed!\n\n"
-                "You have exceeded the maximum number of attempts (3). "
-                "Please try again later or contact support if you believe this is an error.",
-                reply_markup=ReplyKeyboardMarkup(
-                    [],
-                    one_time_keyboard=True,  # remove keyboard
-                ),
-            )
-            # Reset attempt count
-            attempt_counts[user_id] = 0
-            return ConversationHandler.END  # End the conversation
+        retry_key, failed_key = "invalid_location", "invalid_location_failed"
+
+    # Increment attempt count
+    attempt_counts[user_id] += 1
+    remaining_attempts = MAX_ATTEMPTS - attempt_counts[user_id]
+
+    if remaining_attempts > 0:
+        await _prompt_retry(update, remaining_attempts, retry_key)
+        return GET_LOCATION  # Remain in the GET_LOCATION state to ask again.
+
+    # Maximum attempts reached
+    await update.message.reply_text(_MESSAGES[failed_key], reply_markup=REMOVE_KB)
+    # Reset attempt count
+    attempt_counts[user_id] = 0
+    return ConversationHandler.END  # End the conversation
 
 
 async def cancel(update: Update, context: CallbackContext) -> int:
@@ -327,24 +466,56 @@ async def cancel(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 
+# Conversation handler with states, built once at import time
+CONV_HANDLER = ConversationHandler(
+    entry_points=[CommandHandler("start", start)],
+    states={
+        CHECK_IN: [CommandHandler("checkin", checkin)],
+        GET_LOCATION: [MessageHandler(filters.LOCATION, get_location)],
+    },
+    fallbacks=[CommandHandler("cancel", cancel)],
+)
+
+
+async def post_init(application: Application) -> None:
+    """Starts the background attendance flusher once the event loop is running."""
+    global _attendance_q, _flusher_task
+    _attendance_q = asyncio.Queue()
+    _flusher_task = asyncio.create_task(_flusher())
+
+
+async def post_shutdown(application: Application) -> None:
+    """Writes any queued attendance records and closes the database."""
+    # post_init may not have run if startup failed (e.g. an invalid token)
+    try:
+        if _flusher_task is not None and not _flusher_task.done():
+            await _attendance_q.join()
+        if _flusher_task is not None:
+            _flusher_task.cancel()
+    finally:
+        if db_conn is not None:
+            db_conn.close()
+
+
 def main() -> None:
     """
     Main function to start the Telegram bot.
     """
-    application = ApplicationBuilder().token(TOKEN).build()
-
-    # Define conversation handler with states
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            CHECK_IN: [CommandHandler("checkin", checkin)],
-            GET_LOCATION: [MessageHandler(filters.LOCATION, get_location)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
+    global db_conn
+    # Fail on a missing token before touching the database
+    token = _get_token()
+    db_conn = init_db(ATTENDANCE_DB_PATH)
+
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
     )
 
     # Add handlers to the application
-    application.add_handler(conv_handler)
+    application.add_handler(CONV_HANDLER)
 
     # Start the bot
     application.run_polling(allowed_updates=Update.ALL_TYPES)